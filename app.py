@@ -1,8 +1,12 @@
-from flask import Flask, jsonify, request, send_file, Response, stream_with_context
-from flask_cors import CORS
+from quart import Quart, jsonify, request, send_file, Response, stream_with_context
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+import asyncio
 import os
 import sys
-import json
+import threading
+import time
+import orjson
 from qbyte_utils import QbyteDataProcessor
 import subprocess
 from datetime import datetime
@@ -13,9 +17,25 @@ sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__f
 # Import our headless QByte implementation
 from qbyte_headless import run_qbyte, QByteHeadless
 
-# Create Flask app
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def dumps(obj):
+    """Serialize obj to a JSON string, writing NumPy arrays directly"""
+    return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that uses orjson for jsonify and request parsing"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+# Create Quart app (served over ASGI, e.g. `uvicorn app:app`)
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+app = cors(app)  # Enable CORS for all routes
 
 # Root directory
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -24,6 +44,40 @@ QBYTE_DIR = os.path.join(ROOT_DIR, 'Qbyte')
 # Initialize data processor
 data_processor = QbyteDataProcessor(QBYTE_DIR)
 
+# Seconds a cached /api/files listing is reused while the directory is unchanged
+FILES_CACHE_TTL = 2.0
+
+# Serialized JSON payloads, keyed by name and tagged with the mtime of their source path
+_json_cache = {}
+_json_cache_lock = threading.Lock()
+
+def cached_json(key, path, build, ttl=None):
+    """Return a JSON response for build(), reusing it until the mtime of path changes.
+
+    If ttl is given, the cached payload is also rebuilt once it is older than ttl
+    seconds. Returns None if path does not exist or build() returns None.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    now = time.monotonic()
+    with _json_cache_lock:
+        cached = _json_cache.get(key)
+    if (cached is not None and cached[0] == mtime
+            and (ttl is None or now - cached[2] < ttl)):
+        return Response(cached[1], mimetype='application/json')
+    
+    # Build and serialize outside the lock so a slow miss doesn't block other requests;
+    # concurrent misses may rebuild the same payload, which is harmless
+    payload = build()
+    if payload is None:
+        return None
+    body = orjson.dumps(payload, option=ORJSON_OPTIONS)
+    with _json_cache_lock:
+        _json_cache[key] = (mtime, body, now)
+    return Response(body, mimetype='application/json')
+
 @app.route('/')
 def index():
     """API root endpoint with documentation"""
@@ -46,16 +100,24 @@ def index():
 @app.route('/api/files')
 def get_files():
     """Get list of available Qbyte data files"""
+    # QBYTE_DIR's mtime only changes when entries are added, removed or renamed,
+    # not when runs append to their files, so also bound how stale sizes can get
+    return cached_json('files', QBYTE_DIR, list_files, ttl=FILES_CACHE_TTL)
+
+def list_files():
+    """Scan QBYTE_DIR for Qbyte data files"""
     files = []
-    for file in os.listdir(QBYTE_DIR):
-        if file.startswith('QB_') and file.endswith('.txt'):
-            files.append({
-                'name': file,
-                'path': os.path.join(QBYTE_DIR, file),
-                'size': os.path.getsize(os.path.join(QBYTE_DIR, file)),
-                'created': os.path.getctime(os.path.join(QBYTE_DIR, file))
-            })
-    return jsonify(files)
+    with os.scandir(QBYTE_DIR) as entries:
+        for entry in entries:
+            if entry.name.startswith('QB_') and entry.name.endswith('.txt') and entry.is_file():
+                stat = entry.stat()
+                files.append({
+                    'name': entry.name,
+                    'path': entry.path,
+                    'size': stat.st_size,
+                    'created': stat.st_ctime
+                })
+    return files
 
 @app.route('/api/file/<filename>')
 def get_file_data(filename):
@@ -87,9 +149,9 @@ def get_file_stats(filename):
     
     try:
         # Parse file and calculate statistics using the data processor
-        params, lines = data_processor.parse_file_header(file_path)
+        params = data_processor.parse_header_only(file_path)
         stats = data_processor.calculate_statistics(params)
-        events = data_processor.count_events(lines)
+        events = data_processor.count_file_events(file_path)
         
         return jsonify({
             'filename': filename,
@@ -101,18 +163,18 @@ def get_file_stats(filename):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/visualization/<filename>')
-def get_visualization(filename):
+async def get_visualization(filename):
     """Generate and return a visualization for a specific file"""
     file_path = os.path.join(QBYTE_DIR, filename)
     if not os.path.exists(file_path):
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        # Generate visualization using the data processor
-        img_io = data_processor.generate_visualization(file_path)
+        # Generate visualization using the data processor, off the event loop
+        img_io = await asyncio.to_thread(data_processor.generate_visualization, file_path)
         
         if img_io:
-            return send_file(img_io, mimetype='image/png')
+            return await send_file(img_io, mimetype='image/png')
         else:
             return jsonify({'error': 'No valid data found in file'}), 400
     except Exception as e:
@@ -121,48 +183,61 @@ def get_visualization(filename):
 @app.route('/api/shapes')
 def get_shapes():
     """Get list of available shapes"""
+    return cached_json('shapes', QBYTE_DIR, list_shapes)
+
+def list_shapes():
+    """Scan QBYTE_DIR for shape simulation files"""
     shapes = ['hypercube', 'sphere', 'pyramid', 'AEM', 'quad']
     shape_data = []
     
+    # Scan the directory once and reuse the cached stat data of each entry
+    with os.scandir(QBYTE_DIR) as entries:
+        sim_entries = {entry.name: entry for entry in entries if entry.name.startswith('sim_')}
+    
     for shape in shapes:
         sim_file = f'sim_{shape}.txt'
-        file_path = os.path.join(QBYTE_DIR, sim_file)
-        if os.path.exists(file_path):
+        entry = sim_entries.get(sim_file)
+        if entry is not None:
             shape_data.append({
                 'name': shape,
                 'file': sim_file,
-                'size': os.path.getsize(file_path),
-                'path': file_path
+                'size': entry.stat().st_size,
+                'path': entry.path
             })
     
-    return jsonify(shape_data)
+    return shape_data
 
 @app.route('/api/shape/<shape_name>')
 def get_shape_data(shape_name):
     """Get data for a specific shape"""
-    shape_data = data_processor.get_shape_data(shape_name)
+    response = cached_json(f'shape:{shape_name}',
+                           data_processor.shape_file_path(shape_name),
+                           lambda: data_processor.get_shape_data(shape_name))
     
-    if shape_data:
-        return jsonify(shape_data)
+    if response is not None:
+        return response
     else:
         return jsonify({'error': 'Shape data not found'}), 404
 
 @app.route('/api/hypercube')
 def get_hypercube():
     """Get hypercube data"""
-    hypercube_data = data_processor.get_hypercube_data()
+    response = cached_json('hypercube',
+                           data_processor.hypercube_file_path(),
+                           data_processor.get_hypercube_data)
     
-    if hypercube_data:
-        return jsonify(hypercube_data)
+    if response is not None:
+        return response
     else:
         return jsonify({'error': 'Hypercube data not found'}), 404
 
 @app.route('/api/run_birthday_party', methods=['GET'])
-def run_birthday_party():
+async def run_birthday_party():
     """Execute 'python QByte.py static BirthdayParty' and stream the output in chunks"""
     continuous = request.args.get('continuous', 'false').lower() == 'true'
     
-    def generate():
+    @stream_with_context
+    async def generate():
         try:
             # Use our headless implementation instead of the original QByte.py
             print(f"Starting headless QByte run at {datetime.now()}")
@@ -175,22 +250,23 @@ def run_birthday_party():
                 yield "data: Starting continuous QByte data generation...\n\n"
                 
                 # Generate data continuously
-                for iteration_data in qbyte.generate_continuous_data():
+                async for iteration_data in qbyte.generate_continuous_data():
                     # Stream each iteration as JSON
-                    yield f"data: {json.dumps(iteration_data)}\n\n"
+                    yield f"data: {dumps(iteration_data)}\n\n"
                     
                 # This point is never reached in continuous mode unless an exception occurs
                 
             else:
                 # Fixed number of iterations
                 iterations = int(request.args.get('iterations', 60))
+                full = request.args.get('full', 'false').lower() == 'true'
                 yield "data: Starting QByte data generation...\n\n"
                 
                 # Generate data in chunks and stream it
-                qbyte = run_qbyte('static', 'BirthdayParty', iterations)
+                qbyte = await asyncio.to_thread(run_qbyte, 'static', 'BirthdayParty', iterations, full)
                 
                 # Stream the results as JSON
-                yield f"data: {json.dumps(qbyte)}\n\n"
+                yield f"data: {dumps(qbyte)}\n\n"
                 
                 # Signal the end of the stream
                 yield "data: [END]\n\n"
@@ -199,21 +275,22 @@ def run_birthday_party():
             yield f"data: Error: {str(e)}\n\n"
             yield "data: [END]\n\n"
     
-    # Return a streaming response
-    return Response(
-        stream_with_context(generate()),
-        mimetype='text/event-stream'
-    )
+    # Return a streaming response; continuous streams must not time out
+    response = Response(generate(), mimetype='text/event-stream')
+    response.timeout = None
+    return response
 
 @app.route('/api/run_qbyte_headless', methods=['GET'])
-def run_qbyte_headless():
+async def run_qbyte_headless():
     """Execute headless QByte with custom parameters and stream the output"""
     mode = request.args.get('mode', 'static')
     remarks = request.args.get('remarks', 'API')
     continuous = request.args.get('continuous', 'false').lower() == 'true'
     iterations = int(request.args.get('iterations', 60))
+    full = request.args.get('full', 'false').lower() == 'true'
     
-    def generate():
+    @stream_with_context
+    async def generate():
         try:
             # Use our headless implementation
             print(f"Starting headless QByte run with mode={mode}, remarks={remarks}")
@@ -226,9 +303,9 @@ def run_qbyte_headless():
                 yield f"data: Starting continuous QByte data generation with mode={mode}, remarks={remarks}...\n\n"
                 
                 # Generate data continuously
-                for iteration_data in qbyte.generate_continuous_data():
+                async for iteration_data in qbyte.generate_continuous_data():
                     # Stream each iteration as JSON
-                    yield f"data: {json.dumps(iteration_data)}\n\n"
+                    yield f"data: {dumps(iteration_data)}\n\n"
                     
                 # This point is never reached in continuous mode unless an exception occurs
                 
@@ -237,10 +314,10 @@ def run_qbyte_headless():
                 yield f"data: Starting QByte data generation with mode={mode}, remarks={remarks}, iterations={iterations}...\n\n"
                 
                 # Generate data
-                qbyte = run_qbyte(mode, remarks, iterations)
+                qbyte = await asyncio.to_thread(run_qbyte, mode, remarks, iterations, full)
                 
                 # Stream the results as JSON
-                yield f"data: {json.dumps(qbyte)}\n\n"
+                yield f"data: {dumps(qbyte)}\n\n"
                 
                 # Signal the end of the stream
                 yield "data: [END]\n\n"
@@ -249,11 +326,7 @@ def run_qbyte_headless():
             yield f"data: Error: {str(e)}\n\n"
             yield "data: [END]\n\n"
     
-    # Return a streaming response
-    return Response(
-        stream_with_context(generate()),
-        mimetype='text/event-stream'
-    )
-
-if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Return a streaming response; continuous streams must not time out
+    response = Response(generate(), mimetype='text/event-stream')
+    response.timeout = None
+    return response
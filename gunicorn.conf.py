@@ -0,0 +1,13 @@
+"""
+Gunicorn configuration for serving the Qbyte API in production
+Run with: gunicorn app:app
+"""
+import os
+
+bind = '0.0.0.0:5000'
+workers = 2 * (os.cpu_count() or 1) + 1
+worker_class = 'uvicorn_worker.UvicornWorker'
+
+# SSE streams can stay open indefinitely, so never time out workers
+timeout = 0
+graceful_timeout = 30
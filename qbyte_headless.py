@@ -5,16 +5,20 @@ This version removes GUI dependencies and focuses on data generation
 import os
 import sys
 import time
-import math
+import asyncio
 import numpy as np
-import scipy.stats
-import json
+from array import array
+import orjson
 from datetime import datetime, timedelta
+from qbyte_stats import bit_count, threshold_statistics
 
 # Add the Qbyte directory to the path
 QBYTE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Qbyte')
 sys.path.append(QBYTE_DIR)
 
+# Pre-encoded decimal text for every byte value, used when writing QBYTE lines
+_DECIMAL = [str(i).encode() for i in range(256)]
+
 class QByteHeadless:
     def __init__(self, mode='static', remarks='API'):
         self.mode = mode
@@ -29,9 +33,12 @@ class QByteHeadless:
         self.HALO = True
         self.TurboUse = False
         
-        # Initialize data structures
-        self.qbyte_data = []
-        self.timestamps = []
+        # Random number generator (simulating RNG hardware)
+        self._rng = np.random.default_rng()
+        
+        # Initialize data structures. Only the bit sum is kept for every iteration;
+        # the raw byte values and timestamps are written to the output file only.
+        self.bit_sums = array('i')
         self.events = {
             'color_events': 0,
             'rotation_events': 0,
@@ -47,128 +54,139 @@ class QByteHeadless:
         with open(self.outfile_path, 'w') as outfile:
             outfile.write(f'ColorZ: {self.ColorZ} RotZ: {self.RotZ} RNG params: {self.UseTrueRNG} {self.HALO} {self.TurboUse}\n')
         
+        # Keep the output file open in append mode until the run finishes, so runs
+        # sharing a path interleave whole flushes instead of overwriting each other.
+        # Lines are accumulated in self._buf and written with one OS write per flush.
+        self._outfile = open(self.outfile_path, 'ab')
+        self._buf = bytearray()
+        self._flush_bytes = 64 * 1024
+        self.flush_every = 10  # Iterations between flushes of the output file
+        self.period = 0.1  # Seconds between iterations
+        
         # Calculate statistics
         self.EX = self.NEDspeed * 4
         self.ColorThres = self.ColorZ * ((self.NEDspeed*8*0.25)**0.5)
         self.RotThres = self.RotZ * ((self.NEDspeed*8*0.25)**0.5)
         
-        self.ActionNumC = math.ceil((self.ColorZ*((8*self.NEDspeed*0.25)**0.5))+(4*self.NEDspeed))
-        self.Pmod_Color = (scipy.stats.binom((self.NEDspeed*8), 0.5).sf(self.ActionNumC-1))*2
-        self.ActionNumR = math.ceil((self.RotZ*((8*self.NEDspeed*0.25)**0.5))+(4*self.NEDspeed))
-        self.Pmod_Rot = (scipy.stats.binom((self.NEDspeed*8), 0.5).sf(self.ActionNumR-1))*2
+        stats = threshold_statistics(self.ColorZ, self.RotZ, self.NEDspeed)
+        self.ActionNumC = stats['ActionNumC']
+        self.Pmod_Color = stats['Pmod_Color']
+        self.ActionNumR = stats['ActionNumR']
+        self.Pmod_Rot = stats['Pmod_Rot']
         
         print(f"Initialized QByte in headless mode with {self.mode} mode and remarks: {self.remarks}")
         print(f"Output files: {self.outfile_path} and {self.cmtfile_path}")
         print(f"Statistics: ActionNumC={self.ActionNumC}, Pmod_Color={self.Pmod_Color}")
         print(f"Statistics: ActionNumR={self.ActionNumR}, Pmod_Rot={self.Pmod_Rot}")
     
-    def generate_bulk_data(self, num_iterations=60):
+    def next_tick(self, deadline):
+        """Advance the iteration deadline and return it with the time left until it"""
+        deadline += self.period
+        delay = deadline - time.perf_counter()
+        if delay <= 0:
+            # Running behind: restart the schedule instead of bursting to catch up
+            deadline = time.perf_counter()
+        return deadline, delay
+    
+    def generate_bulk_data(self, num_iterations=60, full=False):
         """Generate bulk data (similar to the Bulk() function in original QByte.py)"""
         print(f"Generating {num_iterations} iterations of bulk data...")
         
-        for i in range(num_iterations):
-            timestamp = int(time.time()*1000)
-            self.timestamps.append(timestamp)
-            
-            # Generate random data (simulating RNG hardware)
-            values = np.random.randint(0, 256, size=self.NEDspeed).tolist()
-            
-            # Calculate bit sum
-            bit_sum = 0
-            for val in values:
-                bin_str = bin(256 + val)[3:]
-                bit_sum += sum(int(bit) for bit in bin_str)
-            
-            # Create QBYTE line
-            qbyte_line = f"QBYTE,{','.join(map(str, values))},{timestamp},{'T' if self.TurboUse else 'F'}"
-            
-            # Write to output file
-            with open(self.outfile_path, 'a') as outfile:
-                outfile.write(qbyte_line + '\n')
-            
-            # Store data
-            self.qbyte_data.append({
-                'timestamp': timestamp,
-                'bit_sum': bit_sum,
-                'values': values
-            })
-            
-            # Generate events based on thresholds
-            if bit_sum > self.ActionNumC:
-                self.events['color_events'] += 1
-                color_event = f"color,{timestamp}"
-                with open(self.outfile_path, 'a') as outfile:
-                    outfile.write(color_event + '\n')
-            
-            if bit_sum > self.ActionNumR:
-                self.events['rotation_events'] += 1
-                rotation_event = f"rotation,{timestamp}"
-                with open(self.outfile_path, 'a') as outfile:
-                    outfile.write(rotation_event + '\n')
-            
-            self.events['qbyte_lines'] += 1
-            
-            # Print progress
-            if i % 10 == 0:
-                print(f"Generated {i}/{num_iterations} iterations. Current bit sum: {bit_sum}")
-            
-            # Sleep to simulate real-time generation
-            time.sleep(0.1)
-        
-        return self.get_results()
+        try:
+            deadline = time.perf_counter()
+            for i in range(num_iterations):
+                timestamp = int(time.time()*1000)
+                
+                # Generate random data (simulating RNG hardware)
+                arr = self._rng.integers(0, 256, size=self.NEDspeed, dtype=np.uint8)
+                values = arr.tolist()
+                
+                # Calculate bit sum
+                bit_sum = int(bit_count(arr))
+                
+                # Append QBYTE line to the output buffer
+                buf = self._buf
+                buf += b'QBYTE,'
+                buf += b','.join(map(_DECIMAL.__getitem__, values))
+                buf += b',%d,%s\n' % (timestamp, b'T' if self.TurboUse else b'F')
+                
+                # Store data
+                self.bit_sums.append(bit_sum)
+                
+                # Generate events based on thresholds
+                if bit_sum > self.ActionNumC:
+                    self.events['color_events'] += 1
+                    buf += b'color,%d\n' % timestamp
+                
+                if bit_sum > self.ActionNumR:
+                    self.events['rotation_events'] += 1
+                    buf += b'rotation,%d\n' % timestamp
+                
+                self.events['qbyte_lines'] += 1
+                
+                # Write to output file once enough has accumulated
+                if len(buf) >= self._flush_bytes or i % self.flush_every == 0:
+                    self.flush()
+                
+                # Print progress
+                if i % 10 == 0:
+                    print(f"Generated {i}/{num_iterations} iterations. Current bit sum: {bit_sum}")
+                
+                # Sleep until the next tick to simulate real-time generation without drift
+                deadline, delay = self.next_tick(deadline)
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            # Write out whatever was generated even if the loop fails
+            self.close()
+        
+        return self.get_results(full)
     
-    def generate_continuous_data(self):
+    async def generate_continuous_data(self):
         """Generate data continuously, yielding results after each iteration"""
         print("Starting continuous data generation...")
         
         i = 0
+        deadline = time.perf_counter()
         try:
             while True:
                 timestamp = int(time.time()*1000)
-                self.timestamps.append(timestamp)
                 
                 # Generate random data (simulating RNG hardware)
-                values = np.random.randint(0, 256, size=self.NEDspeed).tolist()
+                arr = self._rng.integers(0, 256, size=self.NEDspeed, dtype=np.uint8)
+                values = arr.tolist()
                 
                 # Calculate bit sum
-                bit_sum = 0
-                for val in values:
-                    bin_str = bin(256 + val)[3:]
-                    bit_sum += sum(int(bit) for bit in bin_str)
+                bit_sum = int(bit_count(arr))
                 
-                # Create QBYTE line
-                qbyte_line = f"QBYTE,{','.join(map(str, values))},{timestamp},{'T' if self.TurboUse else 'F'}"
-                
-                # Write to output file
-                with open(self.outfile_path, 'a') as outfile:
-                    outfile.write(qbyte_line + '\n')
+                # Append QBYTE line to the output buffer
+                buf = self._buf
+                buf += b'QBYTE,'
+                buf += b','.join(map(_DECIMAL.__getitem__, values))
+                buf += b',%d,%s\n' % (timestamp, b'T' if self.TurboUse else b'F')
                 
                 # Store data
-                self.qbyte_data.append({
-                    'timestamp': timestamp,
-                    'bit_sum': bit_sum,
-                    'values': values
-                })
+                self.bit_sums.append(bit_sum)
                 
                 # Generate events based on thresholds
                 events_this_iteration = []
                 
                 if bit_sum > self.ActionNumC:
                     self.events['color_events'] += 1
-                    color_event = f"color,{timestamp}"
-                    with open(self.outfile_path, 'a') as outfile:
-                        outfile.write(color_event + '\n')
+                    buf += b'color,%d\n' % timestamp
                     events_this_iteration.append({"type": "color", "timestamp": timestamp})
                 
                 if bit_sum > self.ActionNumR:
                     self.events['rotation_events'] += 1
-                    rotation_event = f"rotation,{timestamp}"
-                    with open(self.outfile_path, 'a') as outfile:
-                        outfile.write(rotation_event + '\n')
+                    buf += b'rotation,%d\n' % timestamp
                     events_this_iteration.append({"type": "rotation", "timestamp": timestamp})
                 
                 self.events['qbyte_lines'] += 1
                 
+                # Write to output file once enough has accumulated
+                if len(buf) >= self._flush_bytes or i % self.flush_every == 0:
+                    self.flush()
+                
                 # Create iteration result
                 iteration_result = {
                     'iteration': i,
@@ -184,25 +202,58 @@ class QByteHeadless:
                 
                 i += 1
                 
-                # Sleep to simulate real-time generation
-                time.sleep(0.1)
+                # Sleep until the next tick without blocking the event loop
+                deadline, delay = self.next_tick(deadline)
+                if delay > 0:
+                    await asyncio.sleep(delay)
                 
                 # Yield the current iteration result
                 yield iteration_result
                 
-        except GeneratorExit:
+        finally:
+            # Runs on GeneratorExit and on cancellation when an ASGI client disconnects
             print("Generator closed after", i, "iterations")
+            self.close()
+    
+    def flush(self):
+        """Write any buffered output lines to the output file"""
+        if self._buf and not self._outfile.closed:
+            self._outfile.write(self._buf)
+            self._outfile.flush()
+            self._buf.clear()
     
-    def get_results(self):
-        """Get the results of the generation"""
+    def close(self):
+        """Flush buffered output and close the output file"""
+        self.flush()
+        self._outfile.close()
+    
+    def get_results(self, full=False, window=100):
+        """Get the results of the generation, with series for the last `window` iterations unless `full`"""
         # Calculate statistics
-        bit_sums = [d['bit_sum'] for d in self.qbyte_data]
-        cum_sum = np.cumsum(bit_sums)
-        expected = np.arange(len(bit_sums)) * 4
-        deviation = cum_sum - expected
+        bit_sums = np.array(self.bit_sums, dtype=np.int32)
+        n = len(bit_sums)
+        deviation = np.cumsum(bit_sums)
+        deviation -= np.arange(n, dtype=np.int32) * 4
         
         # Calculate standard deviation lines
-        std_dev = np.sqrt(np.arange(len(bit_sums)) * 4 * 0.25) * 1.96
+        std_dev = np.sqrt(np.arange(n) * 4 * 0.25) * 1.96
+        
+        data_summary = {
+            'total_iterations': n,
+            'bit_sum_min': int(bit_sums.min()) if n else None,
+            'bit_sum_max': int(bit_sums.max()) if n else None,
+            'bit_sum_mean': float(bit_sums.mean()) if n else None,
+            'final_deviation': int(deviation[-1]) if n else None
+        }
+        
+        # Only ship the most recent part of each series unless asked for all of it
+        start = 0 if full else max(n - window, 0)
+        data_summary.update({
+            'window_start': start,
+            'bit_sums': bit_sums[start:],
+            'cumulative_deviation': deviation[start:],
+            'std_dev': std_dev[start:]
+        })
         
         results = {
             'file_info': {
@@ -225,20 +276,15 @@ class QByteHeadless:
                 'Pmod_Rot': self.Pmod_Rot
             },
             'events': self.events,
-            'data_summary': {
-                'total_iterations': len(self.qbyte_data),
-                'bit_sums': bit_sums,
-                'cumulative_deviation': deviation.tolist(),
-                'std_dev': std_dev.tolist()
-            }
+            'data_summary': data_summary
         }
         
         return results
 
-def run_qbyte(mode='static', remarks='API', iterations=60):
+def run_qbyte(mode='static', remarks='API', iterations=60, full=False):
     """Run QByte in headless mode and return results"""
     qbyte = QByteHeadless(mode, remarks)
-    return qbyte.generate_bulk_data(iterations)
+    return qbyte.generate_bulk_data(iterations, full)
 
 if __name__ == '__main__':
     # If run directly, parse command line arguments
@@ -246,5 +292,5 @@ if __name__ == '__main__':
     remarks = sys.argv[2] if len(sys.argv) > 2 else 'API'
     iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 60
     
-    results = run_qbyte(mode, remarks, iterations)
-    print(json.dumps(results, indent=2))
+    results = run_qbyte(mode, remarks, iterations, full=True)
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode())
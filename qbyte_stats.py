@@ -0,0 +1,30 @@
+"""
+Bit counting and event threshold statistics shared by the headless generator
+and the data processor, kept free of plotting dependencies
+"""
+import math
+import numpy as np
+import scipy.stats
+from functools import lru_cache
+
+# Number of set bits for every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def bit_count(values, axis=None):
+    """Count the 1 bits of a uint8 array with a table lookup, in total or along axis"""
+    return POPCOUNT.take(values).sum(axis=axis, dtype=np.int64)
+
+@lru_cache(maxsize=128)
+def threshold_statistics(ColorZ, RotZ, NEDspeed):
+    """Calculate event thresholds and their probabilities, cached per parameter set"""
+    ActionNumC = math.ceil((ColorZ*((8*NEDspeed*0.25)**0.5))+(4*NEDspeed))
+    Pmod_Color = (scipy.stats.binom((NEDspeed*8), 0.5).sf(ActionNumC-1))*2
+    ActionNumR = math.ceil((RotZ*((8*NEDspeed*0.25)**0.5))+(4*NEDspeed))
+    Pmod_Rot = (scipy.stats.binom((NEDspeed*8), 0.5).sf(ActionNumR-1))*2
+    
+    return {
+        'ActionNumC': ActionNumC,
+        'Pmod_Color': Pmod_Color,
+        'ActionNumR': ActionNumR,
+        'Pmod_Rot': Pmod_Rot
+    }
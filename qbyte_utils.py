@@ -1,9 +1,48 @@
 import os
+import re
+import mmap
+import itertools
+import threading
+from collections import Counter, OrderedDict
 import numpy as np
-import scipy.stats
-import math
-import matplotlib.pyplot as plt
+import matplotlib.style
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from io import BytesIO
+from qbyte_stats import bit_count, threshold_statistics
+
+# Plot style for visualizations, applied once instead of on every render
+matplotlib.style.use('dark_background')
+
+# A complete QBYTE line: values, timestamp and TurboUse flag (LF or CRLF terminated)
+QBYTE_LINE = re.compile(rb'^QBYTE,((?:\d+,)*\d+),(\d+),[TF]\r?$', re.M)
+
+def empty_qbyte_arrays():
+    """Return empty values, timestamps and bit sums arrays"""
+    return (np.empty((0, 0), dtype=np.uint8),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64))
+
+def qbyte_arrays(value_fields, timestamps):
+    """Build values, timestamps and bit sums arrays from matched QBYTE fields"""
+    # Skip rows whose value count differs from the most common one
+    counts = [field.count(b',') for field in value_fields]
+    expected = Counter(counts).most_common(1)[0][0]
+    if any(count != expected for count in counts):
+        rows = [(field, timestamp)
+                for field, timestamp, count in zip(value_fields, timestamps, counts)
+                if count == expected]
+        value_fields = [field for field, _ in rows]
+        timestamps = [timestamp for _, timestamp in rows]
+    
+    values = np.fromstring(b','.join(value_fields), dtype=np.uint8, sep=',')
+    values = values.reshape(len(timestamps), expected + 1)
+    timestamps = np.array(timestamps, dtype=np.int64)
+    
+    # Count the 1 bits of every line in one pass
+    bit_sums = bit_count(values, axis=1)
+    
+    return values, timestamps, bit_sums
 
 class QbyteDataProcessor:
     """Utility class for processing Qbyte data files"""
@@ -12,14 +51,29 @@ class QbyteDataProcessor:
         """Initialize with the path to Qbyte directory"""
         self.qbyte_dir = qbyte_dir
         self.shape_types = ['hypercube', 'sphere', 'pyramid', 'AEM', 'quad']
+        # Rendered PNGs, keyed by (file_path, limit) and tagged with the file's mtime.
+        # Kept in least-recently-used order and bounded to png_cache_size entries.
+        self._png_cache = OrderedDict()
+        self._png_cache_lock = threading.Lock()
+        self.png_cache_size = 32
     
     def parse_file_header(self, file_path):
-        """Parse the header information from a Qbyte file"""
+        """Parse the header information and read all lines from a Qbyte file"""
+        return self.parse_header_only(file_path), self.read_lines(file_path)
+    
+    def read_lines(self, file_path):
+        """Read all lines of a Qbyte file, for endpoints that need the full body"""
         with open(file_path, 'r') as f:
-            lines = f.read().split('\n')
+            return f.read().split('\n')
+    
+    def parse_header_only(self, file_path):
+        """Parse the header information from the first two lines of a Qbyte file"""
+        with open(file_path, 'r') as f:
+            header_line = f.readline().rstrip('\n')
+            first_line = f.readline().rstrip('\n')
         
         # Parse header
-        header = lines[0].split(' ')
+        header = header_line.split(' ')
         params = {
             'ColorZ': float(header[1]) if len(header) > 1 else 1.65,
             'RotZ': float(header[3]) if len(header) > 3 else 1.85
@@ -34,12 +88,12 @@ class QbyteDataProcessor:
                 params['TurboUse'] = header[7] == 'True'
         
         # Get first line to determine NEDspeed
-        if len(lines) > 1:
-            firstline = lines[1].split(',')
+        if first_line:
+            firstline = first_line.split(',')
             params['NEDspeed'] = len(firstline) - 2
             params['TurboUse'] = firstline[-1] == 'T'
         
-        return params, lines
+        return params
     
     def calculate_statistics(self, params):
         """Calculate statistics based on parameters"""
@@ -47,129 +101,177 @@ class QbyteDataProcessor:
         RotZ = params.get('RotZ', 1.85)
         NEDspeed = params.get('NEDspeed', 250)
         
-        # Calculate statistics
-        ActionNumC = math.ceil((ColorZ*((8*NEDspeed*0.25)**0.5))+(4*NEDspeed))
-        Pmod_Color = (scipy.stats.binom((NEDspeed*8), 0.5).sf(ActionNumC-1))*2
-        ActionNumR = math.ceil((RotZ*((8*NEDspeed*0.25)**0.5))+(4*NEDspeed))
-        Pmod_Rot = (scipy.stats.binom((NEDspeed*8), 0.5).sf(ActionNumR-1))*2
+        # Copy so callers can't modify the cached result
+        return dict(threshold_statistics(ColorZ, RotZ, NEDspeed))
+    
+    def extract_qbyte_arrays(self, lines, limit=1000):
+        """Extract QBYTE values, timestamps and bit sums from file lines as arrays"""
+        # Only complete QBYTE lines (ending in the TurboUse flag) are parsed
+        body = '\n'.join(lines[1:limit+1]).encode()
+        matches = [(match.group(1), int(match.group(2))) for match in QBYTE_LINE.finditer(body)]
+        if not matches:
+            return empty_qbyte_arrays()
         
-        return {
-            'ActionNumC': ActionNumC,
-            'Pmod_Color': Pmod_Color,
-            'ActionNumR': ActionNumR,
-            'Pmod_Rot': Pmod_Rot
-        }
+        return qbyte_arrays([field for field, _ in matches],
+                            [timestamp for _, timestamp in matches])
+    
+    def read_qbyte_arrays(self, file_path, limit=1000):
+        """Extract the first limit QBYTE lines of a file as arrays, via a memory map"""
+        value_fields = []
+        timestamps = []
+        
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return empty_qbyte_arrays()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for match in itertools.islice(QBYTE_LINE.finditer(mm), limit):
+                    value_fields.append(match.group(1))
+                    timestamps.append(int(match.group(2)))
+        
+        if not timestamps:
+            return empty_qbyte_arrays()
+        
+        return qbyte_arrays(value_fields, timestamps)
     
     def extract_qbyte_data(self, lines, limit=1000):
         """Extract QBYTE data from file lines"""
-        qbyte_data = []
-        timestamps = []
+        values, timestamps, bit_sums = self.extract_qbyte_arrays(lines, limit)
+        timestamps = timestamps.tolist()
         
-        for i, line in enumerate(lines[1:limit+1]):
-            if 'QBYTE' in line:
-                parts = line.split(',')
-                if len(parts) > 2:
-                    timestamp = int(parts[-2]) if parts[-2].isdigit() else 0
-                    timestamps.append(timestamp)
-                    
-                    # Calculate bit sum for this line
-                    bit_sum = 0
-                    values = []
-                    for val in parts[:-2]:
-                        if val.isdigit():
-                            values.append(int(val))
-                            # Convert to binary and count 1s
-                            bin_str = bin(256 + int(val))[3:]
-                            bit_sum += sum(int(bit) for bit in bin_str)
-                    
-                    qbyte_data.append({
-                        'timestamp': timestamp,
-                        'bit_sum': bit_sum,
-                        'values': values
-                    })
+        qbyte_data = [
+            {'timestamp': timestamp, 'bit_sum': bit_sum, 'values': row}
+            for timestamp, bit_sum, row in zip(timestamps, bit_sums.tolist(), values.tolist())
+        ]
         
         return qbyte_data, timestamps
     
-    def count_events(self, lines):
-        """Count different types of events in the file"""
-        color_events = sum(1 for line in lines if 'color' in line)
-        rotation_events = sum(1 for line in lines if 'rotation' in line)
-        qbyte_lines = sum(1 for line in lines if 'QBYTE' in line)
-        
+    def count_events(self, raw):
+        """Count different types of events in the raw file contents"""
+        # Every record follows the header line, so it starts right after a newline
         return {
-            'color_events': color_events,
-            'rotation_events': rotation_events,
-            'qbyte_lines': qbyte_lines,
-            'total_lines': len(lines)
+            'color_events': raw.count(b'\ncolor,'),
+            'rotation_events': raw.count(b'\nrotation,'),
+            'qbyte_lines': raw.count(b'\nQBYTE,'),
+            'total_lines': raw.count(b'\n') + 1
         }
     
+    def count_file_events(self, file_path, chunk_size=1 << 20):
+        """Count different types of events in a file, reading it in chunks"""
+        totals = {'color_events': 0, 'rotation_events': 0, 'qbyte_lines': 0, 'total_lines': 1}
+        
+        def add(segment):
+            for key, count in self.count_events(segment).items():
+                totals[key] += count - 1 if key == 'total_lines' else count
+        
+        # Each chunk is cut before its last newline so no record straddles two segments
+        tail = b''
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                buf = tail + chunk
+                cut = buf.rfind(b'\n')
+                if cut > 0:
+                    add(buf[:cut])
+                    buf = buf[cut:]
+                tail = buf
+        add(tail)
+        
+        return totals
+    
     def generate_visualization(self, file_path, limit=1000):
         """Generate visualization for a Qbyte file"""
-        params, lines = self.parse_file_header(file_path)
-        qbyte_data, timestamps = self.extract_qbyte_data(lines, limit)
+        key = (file_path, limit)
+        mtime = os.stat(file_path).st_mtime_ns
+        with self._png_cache_lock:
+            cached = self._png_cache.get(key)
+            if cached is not None and cached[0] == mtime:
+                self._png_cache.move_to_end(key)
+                return BytesIO(cached[1])
         
-        if not timestamps or not qbyte_data:
+        values, timestamps, bit_sums = self.read_qbyte_arrays(file_path, limit)
+        
+        if not len(timestamps):
             return None
         
-        # Create visualization
-        plt.figure(figsize=(10, 6))
-        plt.style.use('dark_background')
+        # Create visualization without pyplot's global figure state
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
         
         # Convert timestamps to relative time in hours
-        rel_times = [(t - timestamps[0])/3600000 for t in timestamps]
-        
-        # Extract bit sums
-        bit_sums = [d['bit_sum'] for d in qbyte_data]
+        rel_times = (timestamps - timestamps[0]) / 3600000
         
         # Plot the data
-        plt.plot(rel_times, bit_sums, 'magenta', label='Qbyte Data')
+        ax.plot(rel_times, bit_sums, 'magenta', label='Qbyte Data')
         
         # Calculate and plot the cumulative sum
-        cum_sum = np.cumsum(bit_sums)
-        expected = np.arange(len(bit_sums)) * 4  # Assuming 8 bits per value, 0.5 expected probability
-        plt.plot(rel_times, cum_sum - expected, 'cyan', label='Cumulative Deviation')
+        n = len(bit_sums)
+        deviation = np.cumsum(bit_sums)
+        deviation -= np.arange(n) * 4  # Assuming 8 bits per value, 0.5 expected probability
+        ax.plot(rel_times, deviation, 'cyan', label='Cumulative Deviation')
         
         # Add standard deviation lines
-        std_dev = np.sqrt(np.arange(len(bit_sums)) * 4 * 0.25) * 1.96
-        plt.plot(rel_times, std_dev, 'aqua', linestyle='--', label='+1.96σ')
-        plt.plot(rel_times, -std_dev, 'aqua', linestyle='--', label='-1.96σ')
+        std_dev = np.sqrt(np.arange(n) * 4 * 0.25) * 1.96
+        ax.plot(rel_times, std_dev, 'aqua', linestyle='--', label='+1.96σ')
+        ax.plot(rel_times, -std_dev, 'aqua', linestyle='--', label='-1.96σ')
         
-        plt.title(f'Qbyte Data Analysis: {os.path.basename(file_path)}')
-        plt.xlabel('Time (hours)')
-        plt.ylabel('Bit Count / Deviation')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
+        ax.set_title(f'Qbyte Data Analysis: {os.path.basename(file_path)}')
+        ax.set_xlabel('Time (hours)')
+        ax.set_ylabel('Bit Count / Deviation')
+        ax.legend()
+        ax.grid(True, alpha=0.3)
         
         # Save to BytesIO object
         img_io = BytesIO()
-        plt.savefig(img_io, format='png', bbox_inches='tight')
+        fig.savefig(img_io, format='png', bbox_inches='tight')
+        self._cache_png(key, mtime, img_io.getvalue())
         img_io.seek(0)
-        plt.close()
         
         return img_io
     
+    def _cache_png(self, key, mtime, png):
+        """Store a rendered PNG, dropping deleted files and the least recently used entries"""
+        with self._png_cache_lock:
+            for stale in [k for k in self._png_cache if not os.path.exists(k[0])]:
+                del self._png_cache[stale]
+            self._png_cache[key] = (mtime, png)
+            self._png_cache.move_to_end(key)
+            while len(self._png_cache) > self.png_cache_size:
+                self._png_cache.popitem(last=False)
+    
+    def shape_file_path(self, shape_name):
+        """Get the path of the simulation file for a shape"""
+        return os.path.join(self.qbyte_dir, f'sim_{shape_name}.txt')
+    
+    def hypercube_file_path(self):
+        """Get the path of the hypercube node file"""
+        return os.path.join(self.qbyte_dir, 'HypercubeExt.txt')
+    
     def get_shape_data(self, shape_name, limit=1000):
         """Get data for a specific shape"""
-        sim_file = f'sim_{shape_name}.txt'
-        file_path = os.path.join(self.qbyte_dir, sim_file)
+        file_path = self.shape_file_path(shape_name)
         
         if not os.path.exists(file_path):
             return None
         
         # Read shape data
-        with open(file_path, 'r') as f:
-            lines = f.read().split('\n')[:limit]
-        
-        values = [float(line) for line in lines if line.strip()]
+        if os.path.getsize(file_path):
+            with open(file_path, 'r') as f:
+                values = np.loadtxt(itertools.islice(f, limit), dtype=np.float64, ndmin=1)
+        else:
+            values = np.empty(0, dtype=np.float64)
         
         # Calculate basic statistics
+        has_values = values.size > 0
         stats = {
-            'count': len(values),
-            'min': min(values) if values else None,
-            'max': max(values) if values else None,
-            'mean': np.mean(values) if values else None,
-            'median': np.median(values) if values else None,
-            'std': np.std(values) if values else None
+            'count': values.size,
+            'min': values.min() if has_values else None,
+            'max': values.max() if has_values else None,
+            'mean': values.mean() if has_values else None,
+            'median': np.median(values) if has_values else None,
+            'std': values.std() if has_values else None
         }
         
         return {
@@ -180,27 +282,23 @@ class QbyteDataProcessor:
     
     def get_hypercube_data(self):
         """Get hypercube data"""
-        file_path = os.path.join(self.qbyte_dir, 'HypercubeExt.txt')
+        file_path = self.hypercube_file_path()
         if not os.path.exists(file_path):
             return None
         
+        # Each row is x, y, z and node id; coordinates are stored offset by 4.
+        # Rows with fewer than 4 tab-separated columns are skipped.
         with open(file_path, 'r') as f:
-            lines = f.read().split('\n')
-        
-        nodes = []
-        for line in lines:
-            if line.strip():
-                parts = line.split('\t')
-                if len(parts) >= 4:
-                    nodes.append({
-                        'x': int(parts[0]) - 4,
-                        'y': int(parts[1]) - 4,
-                        'z': int(parts[2]) - 4,
-                        'node': int(parts[3])
-                    })
+            rows = [line for line in f if line.count('\t') >= 3 and line.strip()]
+        if rows:
+            nodes = np.loadtxt(rows, dtype=np.int32, delimiter='\t', usecols=(0, 1, 2, 3), ndmin=2)
+        else:
+            nodes = np.empty((0, 4), dtype=np.int32)
+        nodes[:, :3] -= 4
         
         return {
             'name': 'hypercube',
-            'nodes': nodes,
-            'total_nodes': len(nodes)
+            'nodes_xyz': np.ascontiguousarray(nodes[:, :3]),
+            'node_ids': np.ascontiguousarray(nodes[:, 3]),
+            'total_nodes': int(nodes.shape[0])
         }